@@ -0,0 +1,146 @@
+""" Buffers that accumulate documents across many worker messages and write them to MongoDB in
+batches, trading a small amount of write latency for far fewer round trips to the database. """
+
+import asyncio
+import logging
+import time
+from typing import Dict, List
+
+from aio_pika import IncomingMessage
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import BulkWriteError
+from pymongo.operations import InsertOne, UpdateOne
+
+log = logging.getLogger(__name__)
+
+# MongoDB's error code for a write that violates a unique index
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+# A buffer is flushed as soon as it holds this many documents...
+MAX_BUFFERED_DOCS = 1000
+# ...or once this long has passed since its last flush, whichever comes first.
+MAX_BUFFER_AGE_SECONDS = 0.5
+
+
+async def bulk_write_ignoring_duplicates(collection: AsyncIOMotorCollection, ops: list):
+    """ Performs an unordered bulk write of `ops`, reporting any errors encountered other than
+    duplicate keys (which are expected when the same data is scraped twice). """
+
+    if not ops:
+        return
+
+    try:
+        await collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as bwe:
+        non_dupes = [
+            err
+            for err in bwe.details["writeErrors"]
+            if err.get("code") != DUPLICATE_KEY_ERROR_CODE
+        ]
+        if non_dupes:
+            log.error(
+                "Unhandled bulk write errors: %d (first: %s)", len(non_dupes), non_dupes[0]
+            )
+
+
+class DocumentBuffer:
+    """ Base class for the write buffers.  Subclasses implement `_write()`, which is handed the
+    contents of the buffer and is responsible for persisting them.
+
+    RabbitMQ messages whose results have been added to the buffer can be registered with
+    `ack_after_flush()`; they're only acknowledged once their data has been written, so a crash
+    causes them to be redelivered rather than lost. """
+
+    def __init__(
+        self, max_docs: int = MAX_BUFFERED_DOCS, max_age_seconds: float = MAX_BUFFER_AGE_SECONDS
+    ):
+        self.max_docs = max_docs
+        self.max_age_seconds = max_age_seconds
+        self.docs: List[dict] = []
+        self.messages: List[IncomingMessage] = []
+        self.last_flush = time.monotonic()
+        self.flush_lock = asyncio.Lock()
+
+    def ack_after_flush(self, message: IncomingMessage):
+        self.messages.append(message)
+
+    def should_flush(self) -> bool:
+        return len(self.docs) >= self.max_docs or (
+            time.monotonic() - self.last_flush > self.max_age_seconds
+        )
+
+    async def maybe_flush(self):
+        """ Flushes the buffer if it's full or if it's been too long since the last flush. """
+
+        if self.should_flush():
+            await self.flush()
+
+    async def flush(self):
+        """ Writes out everything currently in the buffer.  If another flush is already in
+        progress, this waits for it to finish first, so everything that was in the buffer when
+        this was called has been written by the time it returns. """
+
+        async with self.flush_lock:
+            self.last_flush = time.monotonic()
+            messages, self.messages = self.messages, []
+            try:
+                await self._write()
+            except Exception:
+                for message in messages:
+                    await message.nack(requeue=True)
+                raise
+
+            for message in messages:
+                await message.ack()
+
+    async def _write(self):
+        raise NotImplementedError()
+
+
+class PopularityBuffer(DocumentBuffer):
+    """ Buffers popularity documents destined for the `popularity` collection. """
+
+    def __init__(self, collection: AsyncIOMotorCollection, **kwargs):
+        super().__init__(**kwargs)
+        self.collection = collection
+
+    def add(self, docs: List[dict]):
+        self.docs.extend(docs)
+
+    async def _write(self):
+        # Swap the pending documents out before awaiting so that messages handled while the
+        # write is in progress go into the next batch rather than being lost.
+        docs, self.docs = self.docs, []
+        if not docs:
+            return
+
+        await self.collection.insert_many(docs, ordered=False)
+
+
+class QuoteBuffer(DocumentBuffer):
+    """ Buffers quote documents destined for the `quotes` collection along with the updates to
+    the `index` collection that accompany them.  Index updates are keyed by instrument ID; if an
+    instrument is quoted more than once between flushes, only its latest update is written. """
+
+    def __init__(
+        self, collection: AsyncIOMotorCollection, index_col: AsyncIOMotorCollection, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.collection = collection
+        self.index_col = index_col
+        self.index_ops: Dict[str, UpdateOne] = {}
+
+    def add(self, docs: List[dict], index_ops: Dict[str, UpdateOne]):
+        self.docs.extend(docs)
+        self.index_ops.update(index_ops)
+
+    async def _write(self):
+        docs, self.docs = self.docs, []
+        index_ops, self.index_ops = list(self.index_ops.values()), {}
+        quote_ops = [InsertOne(doc) for doc in docs]
+
+        # The two collections are independent, so write to both at the same time.
+        await asyncio.gather(
+            bulk_write_ignoring_duplicates(self.index_col, index_ops),
+            bulk_write_ignoring_duplicates(self.collection, quote_ops),
+        )
@@ -1,6 +1,7 @@
 """ Common functionality used by multiple parts of the application. """
 
 import json
+import random
 import re
 
 
@@ -22,3 +23,12 @@ def parse_throttle_res(msg: str) -> int:
         return 120
 
     return int(float(match[1]) + 2.0)
+
+
+def backoff_seconds(attempt: int, base_seconds: float = 30.0, max_seconds: float = 300.0) -> float:
+    """ Returns how long to wait before retrying a failed request, given how many attempts have
+    already been made.  The delay doubles with each attempt up to `max_seconds`, and is jittered
+    so that many workers failing at once don't all retry at the same moment. """
+
+    delay = min(base_seconds * 2 ** attempt, max_seconds)
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -2,6 +2,7 @@
 
 from os import environ
 
+from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient
 import redis
 
@@ -20,7 +21,22 @@ mongo_url = "mongodb://{}{}{}{}{}:{}/".format(
     MONGO_HOST,
     MONGO_PORT,
 )
-mongo_client = MongoClient(mongo_url)
+# Shared by the synchronous and asyncio clients.  Scraped data is re-fetched constantly, so
+# unjournaled acknowledged writes are a worthwhile trade of durability for throughput.  Quote
+# and popularity documents compress well; zstd comes from the `pymongo[zstd]` requirement, with
+# zlib (from the standard library) as the fallback for servers that don't support it.
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 64,
+    "compressors": "zstd,zlib",
+    "retryWrites": True,
+    "w": 1,
+    "journal": False,
+}
+
+mongo_client = MongoClient(mongo_url, **MONGO_CLIENT_OPTIONS)
+# Motor clients attach to the event loop that is current when they're created, so this one is
+# only instantiated once the worker's loop is running.  See `get_async_db()`.
+async_mongo_client = None
 
 
 redis_client = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, db=0)
@@ -32,6 +48,17 @@ def get_db():
     return mongo_client["robinhood"]
 
 
+def get_async_db():
+    """ Returns an asyncio-compatible (Motor) instance of the MongoDB database for this project.
+    Must be called from within a running event loop. """
+
+    global async_mongo_client  # pylint: disable=W0603
+    if async_mongo_client is None:
+        async_mongo_client = AsyncIOMotorClient(mongo_url, **MONGO_CLIENT_OPTIONS)
+
+    return async_mongo_client["robinhood"]
+
+
 def set_update_started():
     """ Marks all data scraping operations as in-progress, invalidates the cache, and marks it as
     invalid until all data scrapes are completed. """
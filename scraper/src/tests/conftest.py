@@ -0,0 +1,6 @@
+import sys
+from os import path
+
+# The scraper's modules import each other as top-level modules (they're run as scripts from
+# `src/`), so that directory needs to be importable for tests that load them.
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
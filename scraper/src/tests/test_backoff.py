@@ -0,0 +1,12 @@
+from ..common import backoff_seconds
+
+
+def test_backoff_grows_exponentially():
+    for attempt, max_delay in enumerate([30, 60, 120, 240]):
+        delay = backoff_seconds(attempt)
+        assert max_delay / 2 <= delay <= max_delay
+
+
+def test_backoff_is_capped():
+    for attempt in range(5, 20):
+        assert 150 <= backoff_seconds(attempt) <= 300
@@ -0,0 +1,173 @@
+import asyncio
+
+from pymongo.errors import BulkWriteError
+from pymongo.operations import UpdateOne
+
+from .. import buffers
+from ..buffers import DUPLICATE_KEY_ERROR_CODE, PopularityBuffer, QuoteBuffer
+
+
+class FakeMessage:
+    def __init__(self):
+        self.acked = False
+        self.nacked = False
+        self.requeued = False
+
+    async def ack(self):
+        self.acked = True
+
+    async def nack(self, requeue=False):
+        self.nacked = True
+        self.requeued = requeue
+
+
+class FakeCollection:
+    """ Records what's written to it.  Writes wait for `gate` to be set if one is given, and
+    raise `error` if there is one. """
+
+    def __init__(self, gate: asyncio.Event = None, error: Exception = None):
+        self.gate = gate
+        self.error = error
+        self.writes = []
+
+    async def _write(self, items):
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        self.writes.append(items)
+
+    async def insert_many(self, docs, ordered=True):
+        await self._write(docs)
+
+    async def bulk_write(self, ops, ordered=True):
+        await self._write(ops)
+
+
+def test_messages_are_acked_once_flushed():
+    async def run():
+        collection = FakeCollection()
+        buffer = PopularityBuffer(collection)
+        message = FakeMessage()
+        buffer.add([{"popularity": 1}])
+        buffer.ack_after_flush(message)
+        assert not message.acked
+
+        await buffer.flush()
+        assert collection.writes == [[{"popularity": 1}]]
+        assert message.acked
+
+    asyncio.run(run())
+
+
+def test_messages_are_nacked_when_write_fails():
+    async def run():
+        buffer = PopularityBuffer(FakeCollection(error=ConnectionError("MongoDB unavailable")))
+        message = FakeMessage()
+        buffer.add([{"popularity": 1}])
+        buffer.ack_after_flush(message)
+
+        try:
+            await buffer.flush()
+        except ConnectionError:
+            pass
+        else:
+            assert False, "the write error should be re-raised"
+
+        assert message.nacked and message.requeued
+        assert not message.acked
+
+    asyncio.run(run())
+
+
+def test_docs_added_during_write_go_into_next_flush():
+    async def run():
+        gate = asyncio.Event()
+        collection = FakeCollection(gate)
+        buffer = PopularityBuffer(collection)
+        buffer.add([{"popularity": 1}])
+
+        flush = asyncio.ensure_future(buffer.flush())
+        await asyncio.sleep(0)
+        buffer.add([{"popularity": 2}])
+        gate.set()
+        await flush
+        assert collection.writes == [[{"popularity": 1}]]
+
+        await buffer.flush()
+        assert collection.writes == [[{"popularity": 1}], [{"popularity": 2}]]
+
+    asyncio.run(run())
+
+
+def test_flush_waits_for_write_in_progress():
+    """ A flush that starts while another is still writing (say, the one for a `__DONE`
+    message) must not return until the earlier write is finished too. """
+
+    async def run():
+        gate = asyncio.Event()
+        collection = FakeCollection(gate)
+        buffer = PopularityBuffer(collection)
+        buffer.add([{"popularity": 1}])
+
+        first_flush = asyncio.ensure_future(buffer.flush())
+        await asyncio.sleep(0)
+        second_flush = asyncio.ensure_future(buffer.flush())
+        await asyncio.sleep(0.01)
+        assert not second_flush.done()
+
+        gate.set()
+        await second_flush
+        assert collection.writes == [[{"popularity": 1}]]
+        await first_flush
+
+    asyncio.run(run())
+
+
+def test_quote_buffer_keeps_latest_index_update_per_instrument():
+    async def run():
+        index_col = FakeCollection()
+        buffer = QuoteBuffer(FakeCollection(), index_col)
+        first = UpdateOne({"instrument_id": "a"}, {"$set": {"n": 1}})
+        latest = UpdateOne({"instrument_id": "a"}, {"$set": {"n": 2}})
+        other = UpdateOne({"instrument_id": "b"}, {"$set": {"n": 1}})
+        buffer.add([{"quote": 1}], {"a": first})
+        buffer.add([{"quote": 2}], {"a": latest, "b": other})
+
+        await buffer.flush()
+        assert index_col.writes == [[latest, other]]
+
+    asyncio.run(run())
+
+
+def make_bulk_write_error(*codes: int) -> BulkWriteError:
+    return BulkWriteError({"writeErrors": [{"code": code, "errmsg": "error"} for code in codes]})
+
+
+def flush_quotes_with_error(monkeypatch, error: BulkWriteError) -> list:
+    """ Flushes a quote buffer whose collection raises `error`, returning what was logged. """
+
+    logged = []
+    monkeypatch.setattr(buffers.log, "error", lambda *args: logged.append(args))
+
+    async def run():
+        buffer = QuoteBuffer(FakeCollection(error=error), FakeCollection())
+        buffer.add([{"quote": 1}, {"quote": 2}], {})
+        await buffer.flush()
+
+    asyncio.run(run())
+    return logged
+
+
+def test_duplicate_key_errors_are_ignored(monkeypatch):
+    error = make_bulk_write_error(DUPLICATE_KEY_ERROR_CODE, DUPLICATE_KEY_ERROR_CODE)
+    assert flush_quotes_with_error(monkeypatch, error) == []
+
+
+def test_other_bulk_write_errors_are_logged(monkeypatch):
+    error = make_bulk_write_error(DUPLICATE_KEY_ERROR_CODE, 121)
+    logged = flush_quotes_with_error(monkeypatch, error)
+    assert len(logged) == 1
+    (_, error_count, first_error) = logged[0]
+    assert error_count == 1
+    assert first_error["code"] == 121
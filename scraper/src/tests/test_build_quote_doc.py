@@ -0,0 +1,26 @@
+from datetime import datetime
+import json
+from os import path
+
+from ..utils import build_quote_doc, pluck, DESIRED_QUOTE_KEYS
+
+
+def test_build_quote_doc():
+    with open(path.join(path.dirname(__file__), "./raw_quote.json")) as json_file:
+        raw_quote_dict = json.load(json_file)
+        updated_at = datetime(2018, 5, 1, 20, 0)
+        doc = build_quote_doc(raw_quote_dict, raw_quote_dict["instrument_id"], updated_at)
+
+        assert doc == {
+            **pluck(DESIRED_QUOTE_KEYS, raw_quote_dict),
+            "instrument_id": "f7a777df-9b1f-47f6-a82f-fe2645f663c2",
+            "updated_at": updated_at,
+        }
+
+
+def test_build_quote_doc_missing_key():
+    doc = build_quote_doc({"bid_price": "1.0000"}, "some-id", None)
+
+    assert doc["bid_price"] == "1.0000"
+    assert doc["ask_price"] is None
+    assert set(doc.keys()) == {"instrument_id", *DESIRED_QUOTE_KEYS}
@@ -0,0 +1,99 @@
+import asyncio
+
+from .. import worker
+
+
+class FakeMessage:
+    def __init__(self, body: str):
+        self.body = body.encode("utf-8")
+
+    async def ack(self):
+        pass
+
+    async def nack(self, requeue=False):
+        pass
+
+    async def reject(self, requeue=False):
+        pass
+
+
+class FakeBuffer:
+    def ack_after_flush(self, message):
+        pass
+
+
+def test_done_waits_for_batch_still_being_collected():
+    """ A `__DONE` that arrives while another worker is still collecting a batch must not be
+    handled until that batch has been stored. """
+
+    events = []
+    ids = ",".join(["id"] * 20)
+
+    async def work_cb(body, client, sem, buffer, worker_request_cooldown_seconds):
+        if body == worker.DONE_MESSAGE:
+            events.append("done")
+            return True
+
+        events.append("start")
+        await asyncio.sleep(0.01)
+        events.append("stored")
+        return True
+
+    async def run():
+        inbox: asyncio.Queue = asyncio.Queue()
+        inflight: set = set()
+        handle_work = worker.make_work_handler(
+            work_cb, FakeBuffer(), asyncio.Semaphore(1), inflight, 0
+        )
+        workers = [
+            asyncio.ensure_future(worker.run_worker(i, inbox, handle_work, 50, inflight))
+            for i in range(2)
+        ]
+
+        await inbox.put(FakeMessage(ids))
+        # Arrives while the first worker is still waiting for more IDs to fill its batch
+        await asyncio.sleep(worker.BATCH_WAIT_SECONDS / 5)
+        await inbox.put(FakeMessage(worker.DONE_MESSAGE))
+        await asyncio.sleep(worker.BATCH_WAIT_SECONDS * 3)
+
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    asyncio.run(run())
+
+    assert events == ["start", "stored", "done"]
+
+
+def test_cancelling_worker_stops_it_mid_batch():
+    """ Shutdown cancels the workers while they're handling messages; they must stop rather than
+    treating the cancellation as a failed batch and waiting for more work. """
+
+    nacked = []
+
+    class TrackedMessage(FakeMessage):
+        async def nack(self, requeue=False):
+            nacked.append(self)
+
+    async def work_cb(body, client, sem, buffer, worker_request_cooldown_seconds):
+        await asyncio.sleep(10)
+        return True
+
+    async def run():
+        inbox: asyncio.Queue = asyncio.Queue()
+        inflight: set = set()
+        handle_work = worker.make_work_handler(
+            work_cb, FakeBuffer(), asyncio.Semaphore(1), inflight, 0
+        )
+        task = asyncio.ensure_future(worker.run_worker(0, inbox, handle_work, 1, inflight))
+
+        await inbox.put(TrackedMessage("AAPL"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.wait_for(asyncio.wait([task]), 1)
+        assert task.cancelled()
+        assert not inflight
+
+    asyncio.run(run())
+
+    assert not nacked
@@ -0,0 +1,76 @@
+import asyncio
+
+import httpx
+
+from .. import worker
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+class FakeClient:
+    """ Works through `responses` one request at a time, raising any that are exceptions. """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    async def get(self, url):
+        response = self.responses[self.calls]
+        self.calls += 1
+        if isinstance(response, Exception):
+            raise response
+        return FakeResponse(response)
+
+
+class FakeBuffer:
+    def add(self, docs, index_ops):
+        pass
+
+    async def maybe_flush(self):
+        pass
+
+
+def fetch_quotes(client: FakeClient) -> bool:
+    async def fetch():
+        return await worker.fetch_quote_async(
+            "AAPL", client, asyncio.Semaphore(1), FakeBuffer(), worker_request_cooldown_seconds=0
+        )
+
+    return asyncio.run(fetch())
+
+
+def test_quote_fetch_backs_off_on_transport_and_decode_errors(monkeypatch):
+    delays = []
+    monkeypatch.setattr(worker, "backoff_seconds", lambda attempt: delays.append(attempt) or 0)
+
+    client = FakeClient(
+        httpx.ConnectError("connection refused"),
+        b"<html>Down for maintenance</html>",
+        b'{"results": []}',
+    )
+
+    assert fetch_quotes(client)
+    assert client.calls == 3
+    assert delays == [0, 1]
+
+
+def test_quote_fetch_backs_off_on_malformed_responses(monkeypatch):
+    delays = []
+    monkeypatch.setattr(worker, "backoff_seconds", lambda attempt: delays.append(attempt) or 0)
+
+    client = FakeClient(
+        b"[]",
+        b"null",
+        b'{"results": [{"symbol": "AAPL", "updated_at": null, "instrument": '
+        b'"https://api.robinhood.com/instruments/450dfc6d-5510-4d40-abfb-f633b7d9be3e/"}]}',
+        b'{"results": []}',
+    )
+
+    assert fetch_quotes(client)
+    assert client.calls == 4
+    assert delays == [0, 1, 2]
@@ -0,0 +1,31 @@
+import asyncio
+
+from .. import worker
+
+
+class FlakyBuffer:
+    """ Fails its first flush, as if MongoDB were briefly unavailable. """
+
+    max_age_seconds = 0.01
+
+    def __init__(self):
+        self.flushes = 0
+
+    async def maybe_flush(self):
+        self.flushes += 1
+        if self.flushes == 1:
+            raise ConnectionError("MongoDB unavailable")
+
+
+def test_flusher_survives_failed_flush():
+    buffer = FlakyBuffer()
+
+    async def run():
+        flusher = asyncio.ensure_future(worker.flush_periodically(buffer))
+        await asyncio.sleep(0.1)
+        assert not flusher.done()
+        flusher.cancel()
+
+    asyncio.run(run())
+
+    assert buffer.flushes > 1
@@ -0,0 +1,19 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+from .. import scrape_instruments
+
+
+class FakeRobinhood:
+    def __init__(self):
+        self.session = requests.Session()
+
+
+def test_make_trader_mounts_pooled_adapter(monkeypatch):
+    monkeypatch.setattr(scrape_instruments, "Robinhood", FakeRobinhood)
+    trader = scrape_instruments.make_trader()
+
+    adapter = trader.session.get_adapter("https://api.robinhood.com/instruments/")
+    assert isinstance(adapter, HTTPAdapter)
+    assert adapter._pool_maxsize == 32  # pylint: disable=W0212
+    assert adapter.max_retries.total == 0
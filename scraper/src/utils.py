@@ -1,5 +1,5 @@
 from datetime import datetime
-from functools import reduce
+from functools import lru_cache
 from typing import List
 
 
@@ -15,17 +15,38 @@ DESIRED_QUOTE_KEYS = [
 
 
 def pluck(keys: List[str], dictionary: dict) -> dict:
+    return {key: value for key, value in dictionary.items() if key in keys}
 
-    def pluck_inner(acc: dict, pair) -> dict:
-        (key, value) = pair
-        return {**acc, key: value} if key in keys else acc
 
-    return reduce(pluck_inner, dictionary.items(), {})
+def make_quote_doc_builder(keys: List[str]):
+    """ Generates a function that builds the document stored for a quote: `keys` plucked from it
+    (missing ones stored as `None`) along with its instrument ID and parsed `updated_at`.  Since
+    the keys are fixed, the whole document is written out as a single dict literal rather than
+    being assembled one key at a time. """
+
+    def field_source(key: str) -> str:
+        value = "updated_at" if key == "updated_at" else "quote.get({!r})".format(key)
+        return "{!r}: {}".format(key, value)
+
+    fields = ", ".join(field_source(key) for key in keys)
+    source = (
+        "def build_quote_doc(quote, instrument_id, updated_at):\n"
+        "    return {{'instrument_id': instrument_id, {}}}\n"
+    ).format(fields)
+
+    namespace: dict = {}
+    exec(source, namespace)  # pylint: disable=W0122
+    return namespace["build_quote_doc"]
+
+
+build_quote_doc = make_quote_doc_builder(DESIRED_QUOTE_KEYS)
 
 
 UPDATED_AT_TIME_FORMAT_STRING = "%Y-%m-%dT%H:%M:%SZ"
 
 
+# Quotes for many instruments tend to share the same handful of `updated_at` values.
+@lru_cache(maxsize=4096)
 def parse_updated_at(updated_at: str) -> datetime:
     return datetime.strptime(updated_at, UPDATED_AT_TIME_FORMAT_STRING)
 
@@ -33,5 +54,7 @@ def parse_updated_at(updated_at: str) -> datetime:
 INSTRUMENT_ID_RGX = r"https://api.robinhood.com/instruments/(.+?)/"
 
 
+# The same instruments show up in every scrape, so their IDs are worth remembering.
+@lru_cache(maxsize=65536)
 def parse_instrument_url(instrument_url: str) -> str:
     return instrument_url.split("instruments/")[1][:-1]
@@ -1,240 +1,551 @@
 """ Defines a worker that subscribes to instrument IDs sent over RabbitMQ and either fetches
 quotes, popularity, or stores the ID in a database. """
 
-import datetime
-from functools import reduce
-from json.decoder import JSONDecodeError
-from pprint import pprint
-
+import asyncio
+from datetime import datetime, timezone
+import logging
+import multiprocessing
+from multiprocessing.connection import wait as wait_for_processes
+import signal
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import aio_pika
 import click
-import pika
+import httpx
+from motor.motor_asyncio import AsyncIOMotorDatabase
+import orjson
 import pymongo
-from pymongo.errors import BulkWriteError
-import requests
+import uvloop
 
-from Robinhood import Robinhood
-from Robinhood.exceptions import InvalidTickerSymbol
+from buffers import DocumentBuffer, PopularityBuffer, QuoteBuffer
+from common import backoff_seconds, parse_throttle_res
+from db import get_async_db, set_popularities_finished, set_quotes_finished, unlock_cache
+from utils import build_quote_doc, parse_instrument_url, parse_updated_at
 
-from common import parse_throttle_res
-from db import get_db, set_popularities_finished, set_quotes_finished, unlock_cache
-from utils import parse_instrument_url, parse_updated_at, pluck, DESIRED_QUOTE_KEYS
+POPULARITY_URL_BASE = "https://api.robinhood.com/instruments/popularity/?ids="
+QUOTE_URL_BASE = "https://api.robinhood.com/quotes/?symbols="
 
-INDEX_COL = get_db()["index"]
+# Popularities for this many instrument IDs are requested at once, combining the IDs from
+# several messages if necessary.  A batch is sent early if no more messages arrive within
+# `BATCH_WAIT_SECONDS` of its first one.
+POPULARITY_BATCH_SIZE = 50
+BATCH_WAIT_SECONDS = 0.1
 
-TRADER = Robinhood()
+DONE_MESSAGE = "__DONE"
 
+ROBINHOOD_HEADERS = {
+    "Accept": "*/*",
+    "Accept-Encoding": "gzip, deflate",
+    "X-Robinhood-API-Version": "1.0.0",
+    "User-Agent": "Robinhood/823 (iPhone; iOS 7.1.2; Scale/2.00)",
+}
 
-def store_popularities(popularity_map: dict, collection: pymongo.collection.Collection):
-    """ Creates an entry in the database for the popularity. """
+REQUEST_TIMEOUT_SECONDS = 15.0
+# Fetches are given up on after this many failed attempts
+MAX_FETCH_ATTEMPTS = 8
+# Worker processes that haven't exited this long after being asked to stop are killed
+WORKER_SHUTDOWN_TIMEOUT_SECONDS = 30.0
 
-    timestamp = datetime.datetime.utcnow()
-    pprint(popularity_map)
-    mapped_documents = map(
-        lambda key: {
-            "timestamp": timestamp,
-            "instrument_id": key,
-            "popularity": popularity_map[key],
-        },
-        popularity_map.keys(),
-    )
+# A single client is shared by every fetch so that TCP, TLS, and HTTP/2 header compression state
+# is reused across requests instead of being renegotiated for each message.
+HTTP_CLIENT = httpx.AsyncClient(
+    http2=True,
+    headers=ROBINHOOD_HEADERS,
+    timeout=REQUEST_TIMEOUT_SECONDS,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+)
 
-    collection.insert_many(mapped_documents)
+log = logging.getLogger(__name__)
 
 
-def store_quotes(quotes: list, collection: pymongo.collection.Collection):
-    """ Creates entries in the database for the provided quotes. """
+async def store_popularities(popularity_map: dict, buffer: PopularityBuffer):
+    """ Queues up an entry in the database for the popularity. """
 
-    def map_quote(quote: dict) -> dict:
-        instrument_id = parse_instrument_url(quote["instrument"])
+    timestamp = datetime.now(timezone.utc)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("popularities=%s", popularity_map)
 
-        plucked = {"instrument_id": instrument_id, **pluck(DESIRED_QUOTE_KEYS, quote)}
-        plucked["updated_at"] = parse_updated_at(plucked["updated_at"])
-        return plucked
+    buffer.add(
+        [
+            {"timestamp": timestamp, "instrument_id": instrument_id, "popularity": popularity}
+            for instrument_id, popularity in popularity_map.items()
+        ]
+    )
+    await buffer.maybe_flush()
+
+
+async def store_quotes(quotes: list, buffer: QuoteBuffer):
+    """ Queues up entries in the database for the provided quotes and updates the index
+    collection with up-to-date tradability info. """
+
+    # Formatting the quotes isn't free, so only do it if they're actually going to be logged.
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(
+            "quotes=%s",
+            [
+                (quote["symbol"], quote["bid_price"], quote["ask_price"])
+                for quote in quotes
+                if quote is not None
+            ],
+        )
 
-    quotes = list(filter(lambda quote: quote != None, quotes))
+    # A single timestamp is shared by every index update in the batch
+    timestamp = datetime.now(timezone.utc)
 
-    def format_quote(quote: dict) -> dict:
-        return {"symbol": quote["symbol"], "bid": quote["bid_price"], "ask": quote["ask_price"]}
+    # Build the quote documents and index updates in a single pass over the quotes
+    quote_docs = []
+    index_ops = {}
+    for quote in quotes:
+        if quote is None:
+            continue
 
-    pprint(list(map(format_quote, quotes)))
+        instrument_id = parse_instrument_url(quote["instrument"])
+        updated_at = parse_updated_at(quote["updated_at"])
 
-    # Update the index collection with up-to-date tradability info
-    timestamp = datetime.datetime.utcnow()
+        quote_docs.append(build_quote_doc(quote, instrument_id, updated_at))
 
-    def update_index_symbol(datum: dict) -> pymongo.operations.UpdateOne:
-        data = {
+        # Plain dicts are kept here rather than `SON`s; pymongo's C encoder has a fast path for
+        # exact dicts, and insertion order already fixes the key order.
+        index_data = {
             "timestamp": timestamp,
-            "has_traded": datum.get("has_traded"),
-            "updated_at": parse_updated_at(datum.get("updated_at")),
-            "trading_halted": datum.get("trading_halted"),
+            "has_traded": quote.get("has_traded"),
+            "updated_at": updated_at,
+            "trading_halted": quote.get("trading_halted"),
         }
-        instrument_id = parse_instrument_url(datum["instrument"])
-
-        return pymongo.operations.UpdateOne({"instrument_id": instrument_id}, {"$set": data})
-
-    ops = list(map(update_index_symbol, quotes))
-    INDEX_COL.bulk_write(ops, ordered=False)
+        # Upsert so that instruments we haven't seen before are added to the index as well
+        index_ops[instrument_id] = pymongo.operations.UpdateOne(
+            {"instrument_id": instrument_id},
+            {"$set": index_data, "$setOnInsert": {"symbol": quote["symbol"]}},
+            upsert=True,
+        )
 
-    quotes = list(map(map_quote, quotes))
-    try:
-        collection.insert_many(quotes, ordered=False)
-    except BulkWriteError as bwe:
-        for err in bwe.details["writeErrors"]:
-            if "duplicate key" not in err["errmsg"]:
-                print("ERROR: Unhandled exception occured during batch write:")
-                pprint(err)
+    buffer.add(quote_docs, index_ops)
+    await buffer.maybe_flush()
 
 
-def fetch_popularity(
+async def fetch_popularity_async(
     instrument_ids: str,
-    collection: pymongo.collection.Collection,
-    sleep,
+    client: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    buffer: PopularityBuffer,
     worker_request_cooldown_seconds=1.0,
-):
-    if instrument_ids == "__DONE":
+) -> bool:
+    if instrument_ids == DONE_MESSAGE:
         print('Received DONE message for popularity fetching; marking as complete in Redis...')
+        await buffer.flush()
         set_popularities_finished()
-        return
+        return True
+
+    url = POPULARITY_URL_BASE + instrument_ids
+
+    for attempt in range(MAX_FETCH_ATTEMPTS):
+        res = None
+        try:
+            # The semaphore is held through the cooldown so that no more than its limit of
+            # requests are issued to Robinhood per cooldown window.
+            async with sem:
+                res = orjson.loads((await client.get(url)).content)
+                popularities = {
+                    parse_instrument_url(datum["instrument"]): datum["num_open_positions"]
+                    for datum in res["results"]
+                }
+                await asyncio.sleep(worker_request_cooldown_seconds)
+
+            await store_popularities(popularities, buffer)
+            return True
+        except KeyError:  # Likely a ratelimit issue; cooldown.
+            if not res.get("detail"):
+                print("ERROR: Unexpected response received from popularity request: {}".format(res))
+                await asyncio.sleep(120)
+                return True
+
+            cooldown_seconds = parse_throttle_res(res["detail"])
+            print(
+                "Popularity fetch request failed; waiting for {} second cooldown...".format(
+                    cooldown_seconds
+                )
+            )
+            await asyncio.sleep(cooldown_seconds)
+        except httpx.TimeoutException:
+            delay = backoff_seconds(attempt)
+            print(
+                "Read timeout while fetching popularity... Sleeping {:.1f} seconds and "
+                "re-trying.".format(delay)
+            )
+            await asyncio.sleep(delay)
+        except httpx.TransportError as err:
+            delay = backoff_seconds(attempt)
+            print(
+                "Error while fetching popularity: {!r}... Sleeping {:.1f} seconds and "
+                "re-trying.".format(err, delay)
+            )
+            await asyncio.sleep(delay)
+        except TypeError:  # They sent back some broken data; just ignore it.
+            print("Robinhood sent back garbage; ignoring.")
+            await asyncio.sleep(backoff_seconds(attempt))
+        except orjson.JSONDecodeError:
+            print("Robinhood API sending back HTML; backing off.")
+            await asyncio.sleep(backoff_seconds(attempt))
 
-    url = "https://api.robinhood.com/instruments/popularity/?ids={}".format(instrument_ids)
+    print("ERROR: Giving up on fetching popularity for instrument ids: {}".format(instrument_ids))
+    return False
 
-    def reduce_popularity(acc: dict, datum: dict) -> dict:
-        instrument_id = parse_instrument_url(datum["instrument"])
 
-        return {**acc, instrument_id: datum["num_open_positions"]}
+async def fetch_quote_async(
+    symbols: str,
+    client: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    buffer: QuoteBuffer,
+    worker_request_cooldown_seconds=1.0,
+) -> bool:
+    if symbols == DONE_MESSAGE:
+        print('Received DONE message for quote fetching; marking as complete in Redis...')
+        await buffer.flush()
+        set_quotes_finished()
+        return True
+
+    url = QUOTE_URL_BASE + symbols
+
+    for attempt in range(MAX_FETCH_ATTEMPTS):
+        res = None
+        try:
+            async with sem:
+                response = await client.get(url)
+                if response.status_code in (400, 404):
+                    print("Error while fetching symbols: {}".format(symbols))
+                    return True
+
+                res = orjson.loads(response.content)
+                quotes = res["results"]
+                await asyncio.sleep(worker_request_cooldown_seconds)
+
+            await store_quotes(quotes, buffer)
+            return True
+        except KeyError:  # Likely a ratelimit issue; cooldown.
+            if not res.get("detail"):
+                print("ERROR: Unexpected response received from quote request: {}".format(res))
+                await asyncio.sleep(120)
+                return True
+
+            cooldown_seconds = parse_throttle_res(res["detail"])
+            print(
+                "Quote fetch request failed; waiting for {} second cooldown...".format(
+                    cooldown_seconds
+                )
+            )
+            await asyncio.sleep(cooldown_seconds)
+        except httpx.TimeoutException:
+            delay = backoff_seconds(attempt)
+            print(
+                "Read timeout while fetching quotes... Sleeping {:.1f} seconds and "
+                "re-trying.".format(delay)
+            )
+            await asyncio.sleep(delay)
+        except httpx.TransportError as err:
+            delay = backoff_seconds(attempt)
+            print(
+                "Error while fetching quotes: {!r}... Sleeping {:.1f} seconds and "
+                "re-trying.".format(err, delay)
+            )
+            await asyncio.sleep(delay)
+        except TypeError:  # They sent back some broken data; just ignore it.
+            print("Robinhood sent back garbage; ignoring.")
+            await asyncio.sleep(backoff_seconds(attempt))
+        except orjson.JSONDecodeError:
+            print("Robinhood API sending back HTML; backing off.")
+            await asyncio.sleep(backoff_seconds(attempt))
 
-    def call_self():
-        """ In the case of some kind of error, wait 30 seconds and then re-call ourself to try
-        again. """
+    print("ERROR: Giving up on fetching quotes for symbols: {}".format(symbols))
+    return False
 
-        sleep(30)
-        fetch_popularity(
-            instrument_ids,
-            collection,
-            sleep,
-            worker_request_cooldown_seconds=worker_request_cooldown_seconds,
-        )
 
-    try:
-        res = TRADER.get_url(url)
-        popularities = reduce(reduce_popularity, res["results"], {})
-        store_popularities(popularities, collection)
-        sleep(worker_request_cooldown_seconds)
-    except KeyError:  # Likely a ratelimit issue; cooldown.
-        if not res.get("results"):
-            print("ERROR: Unexpected response received from popularity request: {}".format(res))
-            sleep(120)
-            return
-
-        print(res)
-        cooldown_seconds = parse_throttle_res(res["detail"])
-        print(
-            "Popularity fetch request failed; waiting for {} second cooldown...".format(
-                cooldown_seconds
-            )
-        )
-        sleep(cooldown_seconds)
+def make_popularity_buffer(db: AsyncIOMotorDatabase) -> PopularityBuffer:
+    return PopularityBuffer(db["popularity"])
 
-        fetch_popularity(
-            instrument_ids,
-            collection,
-            sleep,
-            worker_request_cooldown_seconds=worker_request_cooldown_seconds,
-        )
-    except requests.exceptions.ReadTimeout:
-        print("Read timeout while fetching popularity... Sleeping 30 seconds and re-trying.")
-        call_self()
-    except TypeError:  # They sent back some broken data; just ignore it.
-        print("Robinhood sent back garbage; ignoring.")
-        call_self()
-    except JSONDecodeError:
-        print("Robinhood API sending back HTML; backing off.")
-        call_self()
-
-
-def fetch_quote(
-    symbols: str,
-    collection: pymongo.collection.Collection,
-    sleep,
-    worker_request_cooldown_seconds=1.0,
+
+def make_quote_buffer(db: AsyncIOMotorDatabase) -> QuoteBuffer:
+    return QuoteBuffer(db["quotes"], db["index"])
+
+
+# Each work callback returns `True` once it's done with its message (whether or not anything was
+# stored) or `False` if it gave up and the message should be retried later.  The last element is
+# how many comma-separated items may be combined from several messages into a single request.
+# Quotes aren't combined since one unknown symbol causes Robinhood to reject the whole request.
+WORK_CBS = {
+    "popularity": (
+        fetch_popularity_async,
+        make_popularity_buffer,
+        "instrument_ids",
+        POPULARITY_BATCH_SIZE,
+    ),
+    "quote": (fetch_quote_async, make_quote_buffer, "symbols", 1),
+}
+
+
+async def flush_periodically(buffer: DocumentBuffer):
+    """ Makes sure that buffered documents are written out in a timely manner even if no new
+    messages are coming in to trigger a flush. """
+
+    while True:
+        await asyncio.sleep(buffer.max_age_seconds)
+        try:
+            await buffer.maybe_flush()
+        except asyncio.CancelledError:
+            # Before Python 3.8 this is an `Exception`; let shutdown through.
+            raise
+        except Exception:  # pylint: disable=W0703
+            # The buffer has already nacked the affected messages; keep going so that later
+            # messages still get written out and acknowledged.
+            log.exception("Failed to flush buffered documents.")
+
+
+def is_done_message(message: aio_pika.IncomingMessage) -> bool:
+    return message.body.decode("utf-8") == DONE_MESSAGE
+
+
+async def collect_batch(
+    inbox: asyncio.Queue, first_message: aio_pika.IncomingMessage, max_items: int
+) -> Tuple[List[aio_pika.IncomingMessage], Optional[aio_pika.IncomingMessage]]:
+    """ Starting with `first_message`, pulls messages from `inbox` until together they hold at
+    least `max_items` comma-separated items or `BATCH_WAIT_SECONDS` have passed.  `__DONE` messages
+    are never batched; if one is encountered, it's returned separately to be handled next. """
+
+    batch = [first_message]
+    if is_done_message(first_message):
+        return (batch, None)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + BATCH_WAIT_SECONDS
+    item_count = first_message.body.count(b",") + 1
+    while item_count < max_items:
+        try:
+            message = inbox.get_nowait()
+        except asyncio.QueueEmpty:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(inbox.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+
+        if is_done_message(message):
+            return (batch, message)
+
+        batch.append(message)
+        item_count += message.body.count(b",") + 1
+
+    return (batch, None)
+
+
+def make_work_handler(
+    work_cb, buffer: DocumentBuffer, sem: asyncio.Semaphore, inflight: set, cooldown_seconds: float
 ):
-    if symbols == "__DONE":
-        print('Received DONE message for quote fetching; marking as complete in Redis...')
-        set_quotes_finished()
-        return
+    """ Returns the function that workers use to handle a batch of messages.  `inflight` holds a
+    future for every batch that a worker has started on; `__DONE` messages wait for all of them
+    before being handled. """
+
+    async def handle_work(messages: List[aio_pika.IncomingMessage]):
+        body = ",".join(message.body.decode("utf-8") for message in messages if message.body)
+        if body == DONE_MESSAGE and inflight:
+            # Don't mark the scrape as finished until all outstanding fetches are stored
+            await asyncio.wait(inflight)
+
+        handled = await work_cb(
+            body, HTTP_CLIENT, sem, buffer, worker_request_cooldown_seconds=cooldown_seconds
+        )
+
+        # Messages are only acknowledged once the data fetched for them has been written out
+        for message in messages:
+            if handled:
+                buffer.ack_after_flush(message)
+            else:
+                await message.reject(requeue=True)
 
+    return handle_work
+
+
+async def run_worker(
+    worker_id: int, inbox: asyncio.Queue, handle_work, max_batch_items: int, inflight: set
+):
+    """ Handles batches of messages from the shared inbox one at a time until cancelled.  Many of
+    these run side by side within the process, all sharing the same connections. """
+
+    loop = asyncio.get_running_loop()
+    next_message = None
+    while True:
+        first_message = next_message or await inbox.get()
+
+        # A batch counts as in flight from the moment its first message is taken, so that a
+        # `__DONE` picked up by another worker while this one is still collecting waits for it.
+        finished = None
+        if not is_done_message(first_message):
+            finished = loop.create_future()
+            inflight.add(finished)
+
+        try:
+            (batch, next_message) = await collect_batch(inbox, first_message, max_batch_items)
+            try:
+                await handle_work(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pylint: disable=W0703
+                log.exception("Worker %d failed to handle messages; requeueing them.", worker_id)
+                for message in batch:
+                    await message.nack(requeue=True)
+        finally:
+            if finished is not None:
+                inflight.discard(finished)
+                finished.set_result(None)
+
+
+async def main(
+    mode: str,
+    rabbitmq_host: str,
+    rabbitmq_port: int,
+    concurrency: int,
+    max_inflight_requests: int,
+    prefetch_count: int,
+    worker_request_cooldown_seconds: float,
+):
+    """ Subscribes to the work queue for `mode` and handles messages until the process is
+    stopped.  RabbitMQ, MongoDB, and Robinhood are all driven from the same event loop by
+    `concurrency` worker coroutines, with `max_inflight_requests` of them talking to Robinhood at
+    any one time. """
+
+    (work_cb, make_buffer, channel_name, max_batch_items) = WORK_CBS[mode]
+    buffer = make_buffer(get_async_db())
+    sem = asyncio.Semaphore(max_inflight_requests)
+    # One future per batch currently being handled, resolved once it's finished
+    inflight: set = set()
+
+    # Stop cleanly on SIGINT/SIGTERM so that anything still buffered gets written out below.
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, main_task.cancel)
+
+    handle_work = make_work_handler(work_cb, buffer, sem, inflight, worker_request_cooldown_seconds)
+
+    flusher = asyncio.create_task(flush_periodically(buffer))
+    rabbitmq_connection = await aio_pika.connect_robust(host=rabbitmq_host, port=rabbitmq_port)
     try:
-        res = TRADER.quote_data(symbols)
-        quotes = res["results"]
-        store_quotes(quotes, collection)
-
-        sleep(worker_request_cooldown_seconds)
-    except KeyError:  # Likely a ratelimit issue; cooldown.
-        if not res.get("detail"):
-            print("ERROR: Unexpected response received from quote request: {}".format(res))
-            sleep(120)
-            return
-
-        cooldown_seconds = parse_throttle_res(res["detail"])
-        print(
-            "Quote fetch request failed; waiting for {} second cooldown...".format(cooldown_seconds)
+        rabbitmq_channel = await rabbitmq_connection.channel()
+        await rabbitmq_channel.set_qos(prefetch_count=prefetch_count)
+        queue = await rabbitmq_channel.declare_queue(channel_name)
+
+        # Deliveries are collected into a local queue rather than read through `queue.iterator()`
+        # so that workers can wait on it with a timeout while assembling batches.
+        inbox = asyncio.Queue()
+        await queue.consume(inbox.put)
+
+        await asyncio.gather(
+            *(
+                run_worker(i, inbox, handle_work, max_batch_items, inflight)
+                for i in range(concurrency)
+            )
         )
-        sleep(cooldown_seconds)
+    except asyncio.CancelledError:
+        print("Shutting down worker...")
+    finally:
+        flusher.cancel()
+        # Flush before disconnecting so that the buffered messages can still be acknowledged
+        await buffer.flush()
+        await rabbitmq_connection.close()
+        await HTTP_CLIENT.aclose()
 
-        fetch_quote(
-            symbols,
-            collection,
-            sleep,
-            worker_request_cooldown_seconds=worker_request_cooldown_seconds,
-        )
-    except InvalidTickerSymbol:
-        print("Error while fetching symbols: {}".format(symbols))
-    except requests.exceptions.ReadTimeout:
-        print("Read timeout while fetching quotes... Sleeping 30 seconds and re-trying.")
-        sleep(30)
-        fetch_quote(
-            symbols,
-            collection,
-            sleep,
-            worker_request_cooldown_seconds=worker_request_cooldown_seconds,
-        )
 
+def run_async_worker(verbose: bool, *main_args):
+    """ Runs a worker event loop until it's stopped.  This is the entrypoint of each worker
+    process, so it sets up everything that can't be inherited from the parent. """
 
-WORK_CBS = {
-    "popularity": (fetch_popularity, "popularity", "instrument_ids"),
-    "quote": (fetch_quote, "quotes", "symbols"),
-}
+    # Only this module's logging becomes verbose; library loggers (httpx, h2, aio_pika) log per
+    # frame at debug level, which would put a flood of output back on the hot path.
+    logging.basicConfig(level=logging.INFO)
+    log.setLevel(logging.DEBUG if verbose else logging.INFO)
+    uvloop.install()
+    asyncio.run(main(*main_args))
 
 
 @click.command()
 @click.option("--mode", type=click.Choice(["quote", "popularity"]), default="popularity")
 @click.option("--rabbitmq_host", default="localhost")
 @click.option("--rabbitmq_port", type=click.INT, default=5672)
+@click.option("--procs", type=click.INT, default=1)
+@click.option("--concurrency", type=click.INT, default=32)
+@click.option("--max_inflight_requests", type=click.INT, default=16)
+@click.option("--prefetch_count", type=click.INT, default=64)
 @click.option("--worker_request_cooldown_seconds", type=click.FLOAT, default=1.0)
-def cli(mode: str, rabbitmq_host: str, rabbitmq_port: str, worker_request_cooldown_seconds: float):
+@click.option("--verbose", is_flag=True, default=False)
+def cli(
+    mode: str,
+    rabbitmq_host: str,
+    rabbitmq_port: int,
+    procs: int,
+    concurrency: int,
+    max_inflight_requests: int,
+    prefetch_count: int,
+    worker_request_cooldown_seconds: float,
+    verbose: bool,
+):
     print('Unlocking cache...')
     unlock_cache()
 
-    rabbitmq_connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=rabbitmq_host, port=rabbitmq_port)
+    worker_args = (
+        verbose,
+        mode,
+        rabbitmq_host,
+        rabbitmq_port,
+        concurrency,
+        max_inflight_requests,
+        prefetch_count,
+        worker_request_cooldown_seconds,
     )
-    rabbitmq_channel = rabbitmq_connection.channel()
-
-    (work_cb, collection_name, channel_name) = WORK_CBS[mode]
-    db = get_db()
-    collection = db[collection_name]
-    rabbitmq_channel.queue_declare(queue=channel_name)
-
-    def handle_work(_channel, _method, _properties, body):
-        work_cb(
-            body.decode("utf-8"),
-            collection,
-            rabbitmq_connection.sleep,
-            worker_request_cooldown_seconds=worker_request_cooldown_seconds,
-        )
+    if procs == 1:
+        run_async_worker(*worker_args)
+        return
+
+    # Each process has its own event loop and its own RabbitMQ, MongoDB, and HTTP clients (none
+    # of which are safe to share across a fork, hence "spawn").  RabbitMQ spreads messages across
+    # the processes' consumers.  Note that `max_inflight_requests` applies to each process.
+    print("Starting {} worker processes...".format(procs))
+    spawn = multiprocessing.get_context("spawn")
+    processes = [spawn.Process(target=run_async_worker, args=worker_args) for _ in range(procs)]
+
+    # Being told to stop is passed on to the workers rather than leaving them running on their own
+    stop_signals = []
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, _frame: stop_signals.append(signum))
+    for process in processes:
+        process.start()
+
+    # Otherwise, workers only exit if something went wrong, so as soon as any of them does, stop
+    # the rest and exit with an error so that we get restarted.  The wait is done in short steps
+    # because it's retried rather than interrupted when a signal arrives.
+    sentinels = [process.sentinel for process in processes]
+    while not stop_signals and not wait_for_processes(sentinels, timeout=1.0):
+        pass
+
+    # SIGTERM lets the workers flush their buffers, but one that's stuck is killed outright.
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT_SECONDS
+    for process in processes:
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            print("Worker process {} didn't stop in time; killing it.".format(process.pid))
+            process.kill()
+        process.join()
+
+    if stop_signals:
+        print("Worker processes stopped.")
+        return
 
-    rabbitmq_channel.basic_consume(handle_work, queue=channel_name, no_ack=True)
-    rabbitmq_channel.start_consuming()
+    print("A worker process exited; shutting down.")
+    sys.exit(1)
 
 
 if __name__ == "__main__":